@@ -6,10 +6,12 @@ an optimized network. Basic information of network can be summarized as well as
 constraint gaps can be double-checked.
 """
 
-from .descriptors import (expand_series, get_switchable_as_dense as get_as_dense,
-                          nominal_attrs)
+from .descriptors import get_switchable_as_dense as get_as_dense, nominal_attrs
 import pandas as pd
+import numpy as np
+from scipy.sparse import csr_matrix, diags
 import logging
+from functools import lru_cache
 
 idx = pd.IndexSlice
 
@@ -31,10 +33,20 @@ def calculate_costs(n):
 
 def calculate_curtailment(n):
     max_pu = n.generators_t.p_max_pu
-    avail = (max_pu.multiply(n.generators.p_nom_opt.loc[max_pu.columns]).sum()
-             .groupby(n.generators.carrier).sum())
-    used = (n.generators_t.p[max_pu.columns].sum()
-            .groupby(n.generators.carrier).sum())
+    gens_i = max_pu.columns
+    carrier = n.generators.carrier.loc[gens_i].astype('category')
+    codes = carrier.cat.codes.to_numpy()
+    carriers = carrier.cat.categories.rename('carrier')
+    # generators without carrier (code -1) are dropped as in a groupby
+    valid = codes >= 0
+
+    def carrier_sum(per_generator):
+        return pd.Series(np.bincount(codes[valid], per_generator[valid],
+                                     len(carriers)), carriers)
+
+    p_nom = n.generators.p_nom_opt.loc[gens_i].to_numpy()
+    avail = carrier_sum((max_pu.to_numpy() * p_nom).sum(0))
+    used = carrier_sum(n.generators_t.p[gens_i].to_numpy().sum(0))
     return (((avail - used)/avail)*100).round(3)
 
 
@@ -46,7 +58,120 @@ def calculate_curtailment(n):
 # =============================================================================
 
 
-def describe_storage_unit_contraints(n):
+def _dense_lookup(n):
+    """
+    Returns a memoized lookup function (c, attr) -> array of
+    get_switchable_as_dense(n, c, attr), such that overlapping time-series are
+    only built once.
+    """
+    @lru_cache(maxsize=None)
+    def dense(c, attr):
+        return get_as_dense(n, c, attr).to_numpy()
+    return dense
+
+
+class _Scratch(object):
+    """
+    Reusable float buffer from which the gap checks take their
+    (snapshots x components) working arrays, such that consecutive checks do
+    not allocate their own. It holds `slots` non-overlapping arrays of up to
+    N_max columns each.
+    """
+    def __init__(self, T, N_max, slots=2):
+        self.T = T
+        self.N_max = N_max
+        self.buf = np.empty(slots * T * N_max)
+
+    def view(self, N, slot=0):
+        """
+        Returns a contiguous (T x N) view on the given slot of the buffer.
+        """
+        start = slot * self.T * self.N_max
+        return self.buf[start:start + self.T * N].reshape(self.T, N)
+
+
+def _gap_context(n):
+    """
+    Collects what the gap checks share: the snapshot weightings as array, the
+    dense time-series lookup and a scratch buffer large enough for any
+    component.
+    """
+    N_max = max(len(n.df(c)) for c in list(nominal_attrs) + ['Bus'])
+    return dict(eh=n.snapshot_weightings.to_numpy(), dense=_dense_lookup(n),
+                scratch=_Scratch(len(n.snapshots), N_max))
+
+
+def _describe(arr, name):
+    """
+    Same statistics as pandas' describe of all non-NaN entries of the array,
+    computed directly on the flat array. Returns a single-column frame.
+    """
+    flat = arr.ravel('K')
+    nans = np.isnan(flat)
+    if nans.any():
+        flat = flat[~nans]
+    if flat.size:
+        q = np.quantile(flat, [.25, .5, .75])
+        stats = [flat.size, flat.mean(),
+                 flat.std(ddof=1) if flat.size > 1 else np.nan,
+                 flat.min(), *q, flat.max()]
+    else:
+        stats = [0] + [np.nan] * 7
+    index = ['count', 'mean', 'std', 'min', '25%', '50%', '75%', 'max']
+    return pd.DataFrame({name: np.array(stats, dtype=float)}, index=index)
+
+
+def _aligned(df, columns, fill_value=np.nan):
+    """
+    Returns the values of a time-series frame aligned to the given columns,
+    the frame is only reindexed if its columns differ.
+    """
+    if df.columns.equals(columns):
+        return df.to_numpy()
+    return df.reindex(columns=columns, fill_value=fill_value).to_numpy()
+
+
+def _min(arr):
+    """
+    Minimum of an array ignoring NaN's, returns NaN for empty or all-NaN
+    arrays.
+    """
+    if not arr.size:
+        return np.nan
+    minimum = arr.min()
+    if not np.isnan(minimum):
+        return minimum
+    return np.nan if np.isnan(arr).all() else np.nanmin(arr)
+
+
+@lru_cache(maxsize=None)
+def _soc_residual_kernel():
+    """
+    Returns the numba compiled kernel for the state of charge balance of
+    storage units, or None if numba is not installed. numba is only imported
+    on first use and the compiled kernel is cached on disk.
+    """
+    try:
+        from numba import njit, prange
+    except ImportError:
+        return None
+
+    @njit(parallel=True, cache=True)
+    def soc_residual(stand_eff, store_eff, dispatch_eff, eh, start, p_store,
+                     p_dispatch, inflow, spill, soc, out):
+        # inflow and spill are expected to be weighted already
+        T, S = soc.shape
+        for t in prange(T):
+            for s in range(S):
+                previous = soc[t-1, s] if t > 0 else start[s]
+                out[t, s] = (stand_eff[t, s] * previous
+                             + eh[t] * (store_eff[s] * p_store[t, s]
+                                        - p_dispatch[t, s] / dispatch_eff[s])
+                             + inflow[t, s] - spill[t, s] - soc[t, s])
+    return soc_residual
+
+
+def describe_storage_unit_contraints(n, ctx=None):
     """
     Checks whether all storage units are balanced over time. This function
     requires the network to contain the separate variables p_store and
@@ -58,122 +183,177 @@ def describe_storage_unit_contraints(n):
     sus = n.storage_units
     sus_i = sus.index
     if sus_i.empty: return
-    sns = n.snapshots
     c = 'StorageUnit'
     pnl = n.pnl(c)
-
-    description = {}
-
-    eh = expand_series(n.snapshot_weightings, sus_i)
-    stand_eff = expand_series(1-n.df(c).standing_loss, sns).T.pow(eh)
-    dispatch_eff = expand_series(n.df(c).efficiency_dispatch, sns).T
-    store_eff = expand_series(n.df(c).efficiency_store, sns).T
-    inflow = get_as_dense(n, c, 'inflow') * eh
-    spill = eh[pnl.spill.columns] * pnl.spill
-
-    description['Spillage Limit'] = pd.Series({'min':
-                                (inflow[spill.columns] - spill).min().min()})
-
-    if 'p_store' in pnl:
-        soc = pnl.state_of_charge
-
-        store = store_eff * eh * pnl.p_store#.clip(upper=0)
-        dispatch = 1/dispatch_eff * eh * pnl.p_dispatch#(lower=0)
-        start = soc.iloc[-1].where(sus.cyclic_state_of_charge,
-                                   sus.state_of_charge_initial)
-        previous_soc = stand_eff * soc.shift().fillna(start)
-
-
-        reconstructed = (previous_soc.add(store, fill_value=0)
-                        .add(inflow, fill_value=0)
-                        .add(-dispatch, fill_value=0)
-                        .add(-spill, fill_value=0))
-        description['SOC Balance StorageUnit'] = ((reconstructed - soc)
-                                                  .unstack().describe())
-    else:
+    if ctx is None: ctx = _gap_context(n)
+    dense, scratch = ctx['dense'], ctx['scratch']
+
+    # align all time-series once to the storage units, missing columns are
+    # treated as zero
+    def as_array(df):
+        return df.reindex(columns=sus_i, fill_value=0).to_numpy()
+
+    eh = ctx['eh'][:, None]
+    dispatch_eff = sus.efficiency_dispatch.to_numpy()
+    store_eff = sus.efficiency_store.to_numpy()
+    inflow = dense(c, 'inflow') * eh
+    spill = eh * as_array(pnl.spill)
+
+    # spill columns of storage units not in n.storage_units are ignored
+    spill_i = sus_i.get_indexer(pnl.spill.columns)
+    spill_i = spill_i[spill_i >= 0]
+    spill_gap = inflow[:, spill_i] - spill[:, spill_i]
+    spillage = pd.DataFrame({'Spillage Limit': _min(spill_gap)}, index=['min'])
+
+    if 'p_store' not in pnl:
         logging.info('Storage Unit SOC balance not reconstructable as no '
                      'p_store and p_dispatch in n.storage_units_t.')
-    return pd.concat(description, axis=1, sort=False)
-
-
-def describe_nodal_balance_constraint(n):
+        return spillage
+
+    soc = pnl.state_of_charge.reindex(columns=sus_i).to_numpy()
+    p_store = as_array(pnl.p_store)
+    p_dispatch = as_array(pnl.p_dispatch)
+    start = np.where(sus.cyclic_state_of_charge.to_numpy(), soc[-1],
+                     sus.state_of_charge_initial.to_numpy())
+
+    residual = scratch.view(len(sus_i))
+    tmp = scratch.view(len(sus_i), slot=1)
+    stand_eff = np.power(1 - sus.standing_loss.to_numpy(), eh, out=tmp)
+    soc_residual = _soc_residual_kernel()
+    if soc_residual is not None:
+        soc_residual(stand_eff, store_eff, dispatch_eff, eh[:, 0], start,
+                     p_store, p_dispatch, inflow, spill, soc, residual)
+    else:
+        residual[0] = start
+        residual[1:] = soc[:-1]
+        residual *= stand_eff
+        # stand_eff is not needed anymore, reuse its buffer
+        np.multiply(p_store, store_eff, out=tmp)
+        tmp *= eh
+        residual += tmp
+        np.divide(p_dispatch, dispatch_eff, out=tmp)
+        tmp *= eh
+        residual -= tmp
+        residual += inflow
+        residual -= spill
+        residual -= soc
+    soc_balance = _describe(residual, 'SOC Balance StorageUnit')
+    return pd.concat([spillage, soc_balance], axis=1, sort=False)
+
+
+def describe_nodal_balance_constraint(n, ctx=None):
     """
     Helper function to double check whether network flow is balanced
     """
-    network_injection = pd.concat(
-            [n.pnl(c)[f'p{inout}'].rename(columns=n.df(c)[f'bus{inout}'])
-            for inout in (0, 1) for c in ('Line', 'Transformer')], axis=1)\
-            .groupby(level=0, axis=1).sum()
-    return (n.buses_t.p - network_injection).unstack().describe()\
-            .to_frame('Nodal Balance Constr.')
-
-def describe_upper_dispatch_constraints(n):
+    buses_i = n.buses.index
+    if buses_i.empty: return
+    if ctx is None: ctx = _gap_context(n)
+    network_injection = ctx['scratch'].view(len(buses_i))
+    network_injection.fill(0)
+    connected = np.zeros(len(buses_i), dtype=bool)
+    for c in ('Line', 'Transformer'):
+        for inout in (0, 1):
+            bus_i = buses_i.get_indexer(n.df(c)[f'bus{inout}'])
+            branch_i, = np.nonzero(bus_i >= 0)
+            bus_i = bus_i[branch_i]
+            p = _aligned(n.pnl(c)[f'p{inout}'], n.df(c).index, fill_value=0)
+            # incidence of the branch ends at the buses
+            incidence = csr_matrix((np.ones(len(bus_i)), (branch_i, bus_i)),
+                                   shape=(p.shape[1], len(buses_i)))
+            network_injection += p @ incidence
+            connected[bus_i] = True
+    # buses without any passive branch attached are not checked
+    balance = np.subtract(n.buses_t.p.reindex(columns=buses_i).to_numpy(),
+                          network_injection, out=network_injection)
+    return _describe(balance[:, connected], 'Nodal Balance Constr.')
+
+def describe_upper_dispatch_constraints(n, ctx=None):
     '''
     Recalculates the minimum gap between operational status and nominal capacity
     '''
+    if ctx is None: ctx = _gap_context(n)
+    dense = ctx['dense']
     description = {}
     key = ' Upper Limit'
     for c, attr in nominal_attrs.items():
+        df = n.df(c)
+        if df.empty: continue
         dispatch_attr = 'p0' if c in ['Line', 'Transformer', 'Link'] else attr[0]
-        description[c + key] = pd.Series({'min':
-                               (n.df(c)[attr + '_opt'] *
-                               get_as_dense(n, c, attr[0] + '_max_pu') -
-                               n.pnl(c)[dispatch_attr]).min().min()})
-    return pd.concat(description, axis=1)
+        dispatch = _aligned(n.pnl(c)[dispatch_attr], df.index)
+        gap = (df[attr + '_opt'].to_numpy() * dense(c, attr[0] + '_max_pu')
+               - dispatch)
+        description[c + key] = _min(gap)
+    if not description: return
+    return pd.DataFrame(description, index=['min'])
 
 
-def describe_lower_dispatch_constraints(n):
+def describe_lower_dispatch_constraints(n, ctx=None):
+    if ctx is None: ctx = _gap_context(n)
+    dense = ctx['dense']
     description = {}
     key = ' Lower Limit'
     for c, attr in nominal_attrs.items():
+        df = n.df(c)
+        if df.empty: continue
         if c in ['Line', 'Transformer', 'Link']:
             dispatch_attr = 'p0'
-            description[c] = pd.Series({'min':
-                              (n.df(c)[attr + '_opt'] *
-                              get_as_dense(n, c, attr[0] + '_max_pu') +
-                              n.pnl(c)[dispatch_attr]).min().min()})
+            dispatch = _aligned(n.pnl(c)[dispatch_attr], df.index)
+            gap = (df[attr + '_opt'].to_numpy() *
+                   dense(c, attr[0] + '_max_pu') + dispatch)
+            description[c] = _min(gap)
         else:
             dispatch_attr = attr[0]
-            description[c + key] = pd.Series({'min':
-                                   (-n.df(c)[attr + '_opt'] *
-                                   get_as_dense(n, c, attr[0] + '_min_pu') +
-                                   n.pnl(c)[dispatch_attr]).min().min()})
-    return pd.concat(description, axis=1)
+            dispatch = _aligned(n.pnl(c)[dispatch_attr], df.index)
+            gap = (-df[attr + '_opt'].to_numpy() *
+                   dense(c, attr[0] + '_min_pu') + dispatch)
+            description[c + key] = _min(gap)
+    if not description: return
+    return pd.DataFrame(description, index=['min'])
 
 
-def describe_store_contraints(n):
+def describe_store_contraints(n, ctx=None):
     """
     Checks whether all stores are balanced over time.
     """
     stores = n.stores
     stores_i = stores.index
     if stores_i.empty: return
-    sns = n.snapshots
     c = 'Store'
     pnl = n.pnl(c)
-
-    eh = expand_series(n.snapshot_weightings, stores_i)
-    stand_eff = expand_series(1-n.df(c).standing_loss, sns).T.pow(eh)
-
-    start = pnl.e.iloc[-1].where(stores.e_cyclic, stores.e_initial)
-    previous_e = stand_eff * pnl.e.shift().fillna(start)
-
-    return (previous_e - pnl.p - pnl.e).unstack().describe()\
-            .to_frame('SOC Balance Store')
+    if ctx is None: ctx = _gap_context(n)
+
+    e = pnl.e.reindex(columns=stores_i).to_numpy()
+    p = pnl.p.reindex(columns=stores_i).to_numpy()
+    start = np.where(stores.e_cyclic.to_numpy(), e[-1],
+                     stores.e_initial.to_numpy())
+
+    scratch = ctx['scratch']
+    eh = ctx['eh'][:, None]
+    stand_eff = np.power(1 - stores.standing_loss.to_numpy(), eh,
+                         out=scratch.view(len(stores_i), slot=1))
+    residual = scratch.view(len(stores_i))
+    residual[0] = start
+    residual[1:] = e[:-1]
+    residual *= stand_eff
+    residual -= p
+    residual -= e
+    return _describe(residual, 'SOC Balance Store')
 
 
 def describe_cycle_constraints(n):
+    if n.lines.empty: return
     weightings = n.lines.x_pu_eff.where(n.lines.carrier == 'AC', n.lines.r_pu_eff)
 
     def cycle_flow(sub):
-        C = pd.DataFrame(sub.C.todense(), index=sub.lines_i())
-        if C.empty:
+        if 0 in sub.C.shape:
             return None
-        C_weighted = 1e5 * C.mul(weightings[sub.lines_i()], axis=0)
-        return C_weighted.apply(lambda ds: ds @ n.lines_t.p0[ds.index].T)
+        lines_i = sub.lines_i()
+        C_weighted = diags(1e5 * weightings[lines_i].to_numpy()) @ sub.C.tocsr()
+        return (C_weighted.T @ n.lines_t.p0[lines_i].to_numpy().T).ravel('K')
 
-    return pd.concat([cycle_flow(sub) for sub in n.sub_networks.obj], axis=0)\
-             .unstack().describe().to_frame('Cycle Constr.')
+    flows = [f for f in map(cycle_flow, n.sub_networks.obj) if f is not None]
+    if not flows: return
+    return _describe(np.concatenate(flows), 'Cycle Constr.')
 
 
 
@@ -183,13 +363,16 @@ def constraint_stats(n, round_digit=1e-30):
     constraints. For inequality constraints only the minimum of lhs - rhs, with
     lhs >= rhs is returned.
     """
-    return pd.concat([describe_cycle_constraints(n),
-                      describe_store_contraints(n),
-                      describe_storage_unit_contraints(n),
-                      describe_nodal_balance_constraint(n),
-                      describe_lower_dispatch_constraints(n),
-                      describe_upper_dispatch_constraints(n)],
-                   axis=1, sort=False)
+    # lookups and buffers shared between the checks, freed when returning
+    ctx = _gap_context(n)
+    stats = [describe_cycle_constraints(n),
+             describe_store_contraints(n, ctx),
+             describe_storage_unit_contraints(n, ctx),
+             describe_nodal_balance_constraint(n, ctx),
+             describe_lower_dispatch_constraints(n, ctx),
+             describe_upper_dispatch_constraints(n, ctx)]
+    # checks for components which are not present return None
+    return pd.concat([s for s in stats if s is not None], axis=1, sort=False)
 
 def check_constraints(n, tol=1e-3):
     """
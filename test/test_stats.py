@@ -0,0 +1,255 @@
+import pypsa
+import warnings
+import pytest
+import pandas as pd
+import numpy as np
+from pypsa import stats
+from pypsa.descriptors import (expand_series, nominal_attrs,
+                               get_switchable_as_dense as get_as_dense)
+from pandas.testing import assert_frame_equal, assert_series_equal
+
+
+def synthetic_network(T=24, seed=0):
+    """
+    Network with random 'optimized' results, such that the gap statistics are
+    non-trivial without the need of a solver.
+    """
+    rng = np.random.RandomState(seed)
+    n = pypsa.Network()
+    n.set_snapshots(pd.date_range('2020', periods=T, freq='H'))
+    n.snapshot_weightings[:] = rng.uniform(0.5, 2, T)
+
+    nb = 6
+    for i in range(nb):
+        n.add('Bus', f'b{i}', carrier='AC' if i < nb - 1 else 'DC')
+    for i in range(nb - 2):
+        n.add('Line', f'l{i}', bus0=f'b{i}', bus1=f'b{i+1}', x=0.1 + i,
+              r=0.01, s_nom_opt=100)
+    # two additional lines close two cycles
+    n.add('Line', 'c0', bus0='b0', bus1='b3', x=0.3, r=0.02, s_nom_opt=50)
+    n.add('Line', 'c1', bus0='b1', bus1='b4', x=0.4, r=0.02, s_nom_opt=50)
+    n.add('Link', 'k0', bus0='b4', bus1='b5', p_nom_opt=30)
+    for i in range(nb):
+        n.add('Generator', f'g{i}', bus=f'b{i}', p_nom_opt=10 + i,
+              carrier=['wind', 'solar', 'gas'][i % 3],
+              p_max_pu=rng.uniform(0, 1, T) if i % 3 != 2 else 1.)
+    for i in range(3):
+        n.add('StorageUnit', f's{i}', bus=f'b{i}', p_nom_opt=5,
+              standing_loss=0.01 * i, efficiency_store=0.9,
+              efficiency_dispatch=0.8, cyclic_state_of_charge=bool(i % 2),
+              state_of_charge_initial=3.,
+              inflow=rng.uniform(0, 1, T) if i == 1 else 0.)
+    for i in range(2):
+        n.add('Store', f'st{i}', bus=f'b{i}', e_nom_opt=5,
+              standing_loss=0.02 * i, e_cyclic=bool(i), e_initial=2.)
+    n.calculate_dependent_values()
+    n.determine_network_topology()
+
+    def random(c, low, high, columns=None):
+        columns = n.df(c).index if columns is None else columns
+        return pd.DataFrame(rng.uniform(low, high, (T, len(columns))),
+                            n.snapshots, columns)
+
+    for c in ['Line', 'Link']:
+        n.pnl(c)['p0'] = random(c, -1, 1)
+        n.pnl(c)['p1'] = random(c, -1, 1)
+    n.generators_t.p = random('Generator', -1, 5)
+    n.buses_t.p = random('Bus', -1, 1)
+    sus_i = n.storage_units.index
+    n.storage_units_t.p = random('StorageUnit', -1, 1)
+    n.storage_units_t.state_of_charge = random('StorageUnit', 0, 5)
+    n.storage_units_t.spill = random('StorageUnit', 0, 1, sus_i[:2])
+    n.storage_units_t.p_store = random('StorageUnit', 0, 1)
+    n.storage_units_t.p_dispatch = random('StorageUnit', 0, 1)
+    n.stores_t.p = random('Store', -1, 1)
+    n.stores_t.e = random('Store', 0, 5)
+    n.lines['carrier'] = n.lines.bus0.map(n.buses.carrier)
+    return n
+
+
+def equal(result, target):
+    assert_frame_equal(result.sort_index(axis=1), target.sort_index(axis=1),
+                       check_dtype=False, rtol=1e-9)
+
+
+def reference_storage_unit_contraints(n):
+    sns = n.snapshots
+    c = 'StorageUnit'
+    sus = n.storage_units
+    pnl = n.pnl(c)
+    eh = expand_series(n.snapshot_weightings, sus.index)
+    stand_eff = expand_series(1 - sus.standing_loss, sns).T.pow(eh)
+    dispatch_eff = expand_series(sus.efficiency_dispatch, sns).T
+    store_eff = expand_series(sus.efficiency_store, sns).T
+    inflow = get_as_dense(n, c, 'inflow') * eh
+    spill = eh[pnl.spill.columns] * pnl.spill
+    description = {'Spillage Limit': pd.Series(
+                   {'min': (inflow[spill.columns] - spill).min().min()})}
+    soc = pnl.state_of_charge
+    store = store_eff * eh * pnl.p_store
+    dispatch = 1/dispatch_eff * eh * pnl.p_dispatch
+    start = soc.iloc[-1].where(sus.cyclic_state_of_charge,
+                               sus.state_of_charge_initial)
+    previous_soc = stand_eff * soc.shift().fillna(start)
+    reconstructed = (previous_soc.add(store, fill_value=0)
+                     .add(inflow, fill_value=0)
+                     .add(-dispatch, fill_value=0)
+                     .add(-spill, fill_value=0))
+    description['SOC Balance StorageUnit'] = ((reconstructed - soc)
+                                              .unstack().describe())
+    return pd.concat(description, axis=1, sort=False)
+
+
+def test_storage_unit_constraints(monkeypatch):
+    # numpy implementation, the numba kernel is tested separately
+    monkeypatch.setattr(stats, '_soc_residual_kernel', lambda: None)
+    n = synthetic_network()
+    equal(stats.describe_storage_unit_contraints(n),
+          reference_storage_unit_contraints(n))
+
+
+def reference_store_contraints(n):
+    pnl = n.stores_t
+    eh = expand_series(n.snapshot_weightings, n.stores.index)
+    stand_eff = expand_series(1 - n.stores.standing_loss,
+                              n.snapshots).T.pow(eh)
+    start = pnl.e.iloc[-1].where(n.stores.e_cyclic, n.stores.e_initial)
+    previous_e = stand_eff * pnl.e.shift().fillna(start)
+    return (previous_e - pnl.p - pnl.e).unstack().describe()\
+            .to_frame('SOC Balance Store')
+
+
+def test_store_constraints():
+    n = synthetic_network()
+    equal(stats.describe_store_contraints(n), reference_store_contraints(n))
+
+
+def reference_dispatch_constraints(n):
+    upper, lower = {}, {}
+    for c, attr in nominal_attrs.items():
+        if n.df(c).empty:
+            continue
+        nom = n.df(c)[attr + '_opt']
+        max_pu = get_as_dense(n, c, attr[0] + '_max_pu')
+        if c in ['Line', 'Transformer', 'Link']:
+            dispatch = n.pnl(c)['p0']
+            lower[c] = (nom * max_pu + dispatch).min().min()
+        else:
+            dispatch = n.pnl(c)[attr[0]]
+            min_pu = get_as_dense(n, c, attr[0] + '_min_pu')
+            lower[c + ' Lower Limit'] = (-nom * min_pu + dispatch).min().min()
+        upper[c + ' Upper Limit'] = (nom * max_pu - dispatch).min().min()
+    return (pd.DataFrame(upper, index=['min']),
+            pd.DataFrame(lower, index=['min']))
+
+
+def test_dispatch_constraints():
+    n = synthetic_network()
+    upper, lower = reference_dispatch_constraints(n)
+    equal(stats.describe_upper_dispatch_constraints(n), upper)
+    equal(stats.describe_lower_dispatch_constraints(n), lower)
+
+
+def test_dispatch_constraints_without_results():
+    n = synthetic_network()
+    n.links_t.p0 = n.links_t.p0.iloc[:, :0]
+    with warnings.catch_warnings():
+        warnings.simplefilter('error', RuntimeWarning)
+        upper = stats.describe_upper_dispatch_constraints(n)
+        lower = stats.describe_lower_dispatch_constraints(n)
+    assert np.isnan(upper.at['min', 'Link Upper Limit'])
+    assert np.isnan(lower.at['min', 'Link'])
+
+
+def reference_nodal_balance_constraint(n):
+    injection = pd.concat(
+        [n.pnl(c)[f'p{inout}'].rename(columns=n.df(c)[f'bus{inout}'])
+         for inout in (0, 1) for c in ('Line', 'Transformer')], axis=1)\
+        .groupby(level=0, axis=1).sum()
+    return (n.buses_t.p - injection).unstack().describe()\
+            .to_frame('Nodal Balance Constr.')
+
+
+def test_nodal_balance_constraint():
+    n = synthetic_network()
+    n.add('Bus', 'bt')
+    n.add('Transformer', 't0', bus0='b2', bus1='bt', x=0.1, s_nom_opt=10)
+    n.transformers_t.p0 = pd.DataFrame({'t0': 0.5}, n.snapshots)
+    n.transformers_t.p1 = pd.DataFrame({'t0': -0.5}, n.snapshots)
+    n.buses_t.p['bt'] = 0.3
+    equal(stats.describe_nodal_balance_constraint(n),
+          reference_nodal_balance_constraint(n))
+
+
+def reference_cycle_constraints(n):
+    weightings = n.lines.x_pu_eff.where(n.lines.carrier == 'AC',
+                                        n.lines.r_pu_eff)
+    flows = []
+    for sub in n.sub_networks.obj:
+        C = pd.DataFrame(sub.C.todense(), index=sub.lines_i())
+        if C.empty:
+            continue
+        C_weighted = 1e5 * C.mul(weightings[sub.lines_i()], axis=0)
+        flows.append(C_weighted.apply(lambda ds: ds @ n.lines_t.p0[ds.index].T))
+    return pd.concat(flows).unstack().describe().to_frame('Cycle Constr.')
+
+
+def test_cycle_constraints():
+    n = synthetic_network()
+    equal(stats.describe_cycle_constraints(n), reference_cycle_constraints(n))
+
+
+def test_spillage_limit_ignores_unknown_storage_units(monkeypatch):
+    monkeypatch.setattr(stats, '_soc_residual_kernel', lambda: None)
+    n = synthetic_network()
+    target = reference_storage_unit_contraints(n)
+    n.storage_units_t.spill['ghost'] = -100.
+    equal(stats.describe_storage_unit_contraints(n), target)
+
+
+def reference_curtailment(n):
+    max_pu = n.generators_t.p_max_pu
+    avail = (max_pu.multiply(n.generators.p_nom_opt.loc[max_pu.columns]).sum()
+             .groupby(n.generators.carrier).sum())
+    used = (n.generators_t.p[max_pu.columns].sum()
+            .groupby(n.generators.carrier).sum())
+    return (((avail - used)/avail)*100).round(3)
+
+
+def test_calculate_curtailment():
+    n = synthetic_network()
+    assert_series_equal(stats.calculate_curtailment(n),
+                        reference_curtailment(n))
+
+    # generators without carrier are ignored
+    n.generators.loc['g0', 'carrier'] = np.nan
+    assert_series_equal(stats.calculate_curtailment(n),
+                        reference_curtailment(n))
+
+
+def test_storage_unit_constraints_numba():
+    pytest.importorskip('numba')
+    assert stats._soc_residual_kernel() is not None
+    n = synthetic_network()
+    equal(stats.describe_storage_unit_contraints(n),
+          reference_storage_unit_contraints(n))
+
+
+def test_constraint_stats():
+    n = synthetic_network()
+    target = pd.concat([reference_cycle_constraints(n),
+                        reference_store_contraints(n),
+                        reference_storage_unit_contraints(n),
+                        reference_nodal_balance_constraint(n),
+                        *reference_dispatch_constraints(n)],
+                       axis=1, sort=False)
+    equal(stats.constraint_stats(n), target)
+
+    # checks of components which are not present are skipped
+    n.mremove('Store', n.stores.index)
+    n.mremove('StorageUnit', n.storage_units.index)
+    result = stats.constraint_stats(n)
+    assert 'SOC Balance Store' not in result
+    assert 'SOC Balance StorageUnit' not in result
+    assert 'Transformer Upper Limit' not in result
+    assert not result.loc['min'].isnull().any()